@@ -42,32 +42,41 @@ def nth(idx):
 
 
 def for_each(*fns):
+    pipeline = apply(*fns)
+
     def _for_each(obj):
         for i, o in enumerate(obj):
-            for fn in fns:
-                obj[i] = fn(o)
+            obj[i] = pipeline(o)
         return obj
     return _for_each
 
 
 def task_ref_matches(name, bundle):
-    def _task_ref_matches(task):
-        name_match = False
-        bundle_match = False
-        kind_match = False
+    name_re = re.compile(name)
+    bundle_re = re.compile(bundle)
 
-        name_re = re.compile(name)
-        bundle_re = re.compile(bundle)
-        for p in task.get('taskRef', {}).get('params', []):
+    def _task_ref_matches(task):
+        task_ref = task.get('taskRef')
+        if not task_ref:
+            return False
+        outstanding = {'kind', 'name', 'bundle'}
+        for p in task_ref.get('params', []):
+            key = p.get('name', '')
             value = p.get('value')
-            match p.get('name', ''):
+            match key:
                 case 'kind':
-                    kind_match = value == 'task'
+                    if value != 'task':
+                        return False
                 case 'name':
-                    name_match = name_re.match(value)
+                    if not name_re.match(value):
+                        return False
                 case 'bundle':
-                    bundle_match = bundle_re.match(value)
-            if name_match and bundle_match and kind_match:
+                    if not bundle_re.match(value):
+                        return False
+                case _:
+                    continue
+            outstanding.discard(key)
+            if not outstanding:
                 return True
         return False
     return _task_ref_matches
@@ -75,14 +84,11 @@ def task_ref_matches(name, bundle):
 
 def delete_if(fn):
     def _delete_if(obj):
-        idxs = []
-        for i, o in enumerate(obj):
-            if fn(o):
-                idxs.append(i)
-        offset = 0
-        for i in idxs:
-            obj.pop(i - offset)
-            offset += 1
+        idxs = [i for i, o in enumerate(obj) if fn(o)]
+        # Delete one by one so that a CommentedSeq keeps the comments of the
+        # remaining items.
+        for i in reversed(idxs):
+            del obj[i]
         return obj
     return _delete_if
 
@@ -94,9 +100,9 @@ def delete_key(key):
     return _delete_key
 
 
-def append(to_add):
+def append(to_add, clone=True):
     def _add(obj):
-        obj.append(copy.deepcopy(to_add))
+        obj.append(copy.deepcopy(to_add) if clone else to_add)
         return obj
     return _add
 
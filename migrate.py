@@ -1,16 +1,16 @@
 import argparse
-import io
 import json
 import logging
 import os
 import re
+import shlex
 import subprocess
 
 import fn
 
 from typing import Callable, Final
 from ruamel.yaml import YAML
-from fn import append, apply, delete_if, delete_key, with_path, if_matches, nth
+from fn import append, apply, delete_if, delete_key
 
 logging.basicConfig(
     level=logging.DEBUG, format="%(levelname)s:%(name)s:%(asctime)s:%(message)s"
@@ -24,22 +24,12 @@ FIELD_TYPE_MAP: Final = "map"
 
 
 def count_leading_spaces(s: str) -> int:
-    n = 0
-    for i in s:
-        if i == " ":
-            n += 1
-        else:
-            break
-    return n
+    return len(s) - len(s.lstrip(" "))
 
 
 def convert_difference(difference: str):
     yaml_lines = []
-    read_buf = io.StringIO(difference)
-    while True:
-        line = read_buf.readline()
-        if not line:
-            break
+    for line in difference.split("\n"):
         s = line.rstrip()
         if not s:
             continue
@@ -53,46 +43,53 @@ def convert_difference(difference: str):
                 yaml_lines.append(" " * spaces_n + s[spaces_n:])
 
     yaml_content = "\n".join(yaml_lines)
-    return create_yaml_obj().load(yaml_content)
+    return SHARED_YAML.load(yaml_content)
+
+
+DYFF_BETWEEN_CMD: Final = (
+    "dyff",
+    "between",
+    "--omit-header",
+    "--no-table-style",
+    "--detect-kubernetes",
+    "--set-exit-code",
+)
 
 
 def compare_pipeline_definitions(from_: str, to: str):
-    compare_cmd = [
-        "dyff",
-        "between",
-        "--omit-header",
-        "--no-table-style",
-        "--detect-kubernetes",
-        "--set-exit-code",
-        from_,
-        to,
-    ]
-    proc = subprocess.run(compare_cmd, capture_output=True, text=True)
+    proc = subprocess.run(
+        [*DYFF_BETWEEN_CMD, from_, to], stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
     if proc.returncode == 0:
         return {}
     if proc.returncode == 1:
-        return convert_difference(proc.stdout)
-    raise RuntimeError(f"Difference comparison error: {proc.stderr}")
+        return convert_difference(proc.stdout.decode("utf-8"))
+    raise RuntimeError(f"Difference comparison error: {proc.stderr.decode('utf-8', errors='replace')}")
 
 
 def load_list_details(s: str):
-    piece = create_yaml_obj().load("list:\n" + s)
+    piece = SHARED_YAML.load("list:\n" + s)
     return piece["list"]
 
 
 def load_map_details(s: str):
-    return create_yaml_obj().load(s)
+    return SHARED_YAML.load(s)
+
+
+COMPACT_JSON_ENCODER: Final = json.JSONEncoder(separators=(", ", ": "))
 
 
 def json_compact_dumps(o) -> str:
-    return json.dumps(o, separators=(", ", ": "))
+    return COMPACT_JSON_ENCODER.encode(o)
 
 
 LIST_MAP_ACTIONS_RE: Final = re.compile(
-    r"^. (?P<count>[a-z]+) (?P<type>list|map) (entry|entries) (?P<operation>added|removed):$"
+    r". (?P<count>[a-z]+) (?P<type>list|map) (entry|entries) (?P<operation>added|removed):"
 )
 
-TK_LIST_FIELDS: Final = ["params", "tasks", "workspaces"]
+TASK_PATH_RE: Final = re.compile(r"^spec\.tasks\.(?P<task_name>[\w-]+)(\.params)?$")
+
+TK_LIST_FIELDS: Final = frozenset(("params", "tasks", "workspaces"))
 
 
 def is_tk_list_fields(name: str) -> bool:
@@ -112,10 +109,8 @@ def generate_yq_commands(differences: dict[str, dict[str, str]]) -> list[str]:
     """
     exprs: list[str] = []  # yq expressions
 
-    path_pattern = r"^spec\.tasks\.(?P<task_name>[\w-]+)(\.params)?$"
-
     for path in differences:
-        if not re.match(path_pattern, path):
+        if not path.startswith("spec.tasks.") or not TASK_PATH_RE.match(path):
             continue
 
         path_filters: list[str] = []
@@ -128,12 +123,11 @@ def generate_yq_commands(differences: dict[str, dict[str, str]]) -> list[str]:
             else:
                 path_filters.append("." + part)
 
-        for action in differences[path]:
-            path_filters_pipe = " | ".join(path_filters)
-            detail = differences[path][action]
-            if (m := LIST_MAP_ACTIONS_RE.match(action)) is not None:
-                op = m.group("operation")
-                type_ = m.group("type")
+        path_filters_pipe = " | ".join(path_filters)
+
+        for action, detail in differences[path].items():
+            if (m := LIST_MAP_ACTIONS_RE.fullmatch(action)) is not None:
+                op, type_ = m.group("operation", "type")
                 if type_ == "list":
                     for detail_item in load_list_details(detail):
                         if op == OP_ADDED:
@@ -160,13 +154,47 @@ def match_task(name: str) -> Callable:
     return _match
 
 
-def match_name_value(name: str, value: str) -> Callable:
+def match_any_name_value(items: list) -> Callable:
+    names = {item["name"] for item in items}
+    # Values may be lists, e.g. for array params, so these are not hashable.
+    name_values = [(item["name"], item["value"]) for item in items]
+
     def _match(obj) -> bool:
-        return obj["name"] == name and obj["value"] == value
+        return obj["name"] in names and (obj["name"], obj["value"]) in name_values
 
     return _match
 
 
+def locate_path(path: str) -> Callable:
+    """Create a callable to locate the object at a difference path
+
+    This does the same as chaining ``with_path`` for every part of the path,
+    and ``if_matches(match_task(part))`` and ``nth(0)`` for the parts inside
+    a list field, but walks the whole path in a single call.
+
+    :param path: a dotted difference path, e.g. ``spec.tasks.init.params``.
+    :type path: str
+    """
+    parts = path.split(".")
+    # (select entry by name?, part)
+    steps = [(i > 0 and is_tk_list_fields(parts[i - 1]), part) for i, part in enumerate(parts)]
+
+    def _locate(obj):
+        for by_name, part in steps:
+            if not by_name:
+                obj = obj[part]
+                continue
+            for item in obj:
+                if item["name"] == part:
+                    obj = item
+                    break
+            else:
+                raise IndexError(f"No entry named {part} for path {path}")
+        return obj
+
+    return _locate
+
+
 # {yaml path => {action => details}}
 DifferencesT = dict[dict[str, str]]
 
@@ -184,27 +212,19 @@ def generate_dsl(differences: DifferencesT):
 
         logger.debug("path: %s", path)
 
-        fns = []
-        parts = path.split(".")
-
-        for i, part in enumerate(parts):
-            if i > 0 and is_tk_list_fields(parts[i - 1]):
-                fns.append(if_matches(match_task(part)))
-                fns.append(nth(0))
-            else:
-                fns.append(with_path(part))
+        fns = [locate_path(path)]
 
         for action, detail in differences[path].items():
-            m = LIST_MAP_ACTIONS_RE.match(action)
-            if m:
-                op = m.group("operation")
-                type_ = m.group("type")
+            if (m := LIST_MAP_ACTIONS_RE.fullmatch(action)) is not None:
+                op, type_ = m.group("operation", "type")
                 if type_ == FIELD_TYPE_LIST:
-                    for detail_item in load_list_details(detail):
-                        if op == OP_ADDED:
+                    detail_items = load_list_details(detail)
+                    if op == OP_ADDED:
+                        for detail_item in detail_items:
                             fns.append(append(detail_item))
-                        elif op == OP_REMOVED:
-                            fns.append(delete_if(match_name_value(**detail_item)))
+                    elif op == OP_REMOVED:
+                        # Match all the removed entries in a single scan.
+                        fns.append(delete_if(match_any_name_value(detail_items)))
                 elif type_ == FIELD_TYPE_MAP:
                     maps = load_map_details(detail)
                     if op == OP_ADDED:
@@ -227,66 +247,99 @@ def create_yaml_obj():
     return yaml
 
 
-def migrate_with_dsl(migrations: list[Callable], pipeline_file: str) -> None:
-    """Apply migrations to given pipeline
+# Reused for parsing the difference details, which are loaded once per
+# action while generating the migrations, and for the pipelines migrated.
+SHARED_YAML: Final = create_yaml_obj()
 
-    :param migrations: list of migration to be applied to pipeline. Each of
-        them is for a single difference path and includes all the necessary
-        migration steps.
-    :type migrations: list[Callable]
-    :param pipeline_file: path to a pipeline to apply the migrations
-    :type pipeline_file: str
-    """
 
-    yaml = create_yaml_obj()
+def resolve_pipeline(origin_pipeline, pipeline_file: str):
+    """Resolve the pipeline definition the migrations are applied to
 
-    with open(pipeline_file, "r", encoding="utf-8") as f:
-        origin_pipeline = yaml.load(f)
+    The returned object has the pipeline definition under ``spec``, so that
+    the difference paths, e.g. ``spec.tasks``, can be located in it. For an
+    inline ``pipelineSpec``, it shares the definition with the PipelineRun,
+    hence modifications to it are dumped with the PipelineRun.
 
-    # TODO: extract this pipeline resolution
+    :param origin_pipeline: the loaded Pipeline or PipelineRun.
+    :param pipeline_file: path to the file ``origin_pipeline`` is loaded from.
+        A pipeline referenced by name is read relatively to it.
+    :type pipeline_file: str
+    """
     match origin_pipeline["kind"]:
         case "Pipeline":
-            pipeline = origin_pipeline
+            return origin_pipeline
         case "PipelineRun":
             if "pipelineSpec" in origin_pipeline["spec"]:
                 # pipeline definition is inline the PipelineRun
-                pipeline = {"spec": origin_pipeline["spec"]["pipelineSpec"]}
+                return {"spec": origin_pipeline["spec"]["pipelineSpec"]}
             elif "pipelineRef" in origin_pipeline["spec"]:
                 # pipeline definition is referenced by name or git-resolver
                 pipeline_ref = origin_pipeline["spec"]["pipelineRef"]
                 if "name" in pipeline_ref:
                     ref_pipeline = os.path.join(os.path.dirname(pipeline_file), pipeline_ref["name"])
                     with open(ref_pipeline, "r", encoding="utf-8") as f:
-                        pipeline = create_yaml_obj().load(f)
+                        return SHARED_YAML.load(f)
                 elif "bundle" in pipeline_ref:
                     # TODO: resolve and read pipeline
-                    raise NotImplemented("read pipeline referenced by git-resolver")
+                    raise NotImplementedError("read pipeline referenced by git-resolver")
                 else:
                     raise ValueError("Unknown pipelineRef section")
             else:
                 raise ValueError("PipelineRun .spec field includes neither .pipelineSpec nor .pipelineRef field.")
+        case _:
+            raise ValueError(f"Unknown kind: {origin_pipeline['kind']}")
+
+
+def migrate_with_dsl(migrations: list[Callable], pipeline_file: str) -> None:
+    """Apply migrations to given pipeline
+
+    :param migrations: list of migration to be applied to pipeline. Each of
+        them is for a single difference path and includes all the necessary
+        migration steps.
+    :type migrations: list[Callable]
+    :param pipeline_file: path to a pipeline to apply the migrations
+    :type pipeline_file: str
+    """
+
+    with open(pipeline_file, "r", encoding="utf-8") as f:
+        origin_pipeline = SHARED_YAML.load(f)
+
+    pipeline = resolve_pipeline(origin_pipeline, pipeline_file)
 
     for migration in migrations:
         logger.debug("applying migration: %r", migration)
         migration(pipeline)
 
     with open(pipeline_file + ".modified", "w", encoding="utf-8") as f:
-        yaml.dump(origin_pipeline, f)
+        SHARED_YAML.dump(origin_pipeline, f)
 
 
 def migrate_with_yq(
     exprs: list[str], pipeline_file: str, dry_run: bool = False
 ) -> None:
+    """Apply yq expressions to given pipeline
+
+    All expressions are chained into a single one so that yq is run only
+    once. The result is written to a ``.modified`` file next to the
+    pipeline, the same as ``migrate_with_dsl`` does, once yq succeeds.
+
+    :param exprs: yq expressions generated by ``generate_yq_commands``.
+    :type exprs: list[str]
+    :param pipeline_file: path to a pipeline to apply the expressions.
+    :type pipeline_file: str
+    :param dry_run: only log the yq command instead of running it.
+    :type dry_run: bool
+    """
+    if not exprs:
+        logger.info("no yq expressions to apply to %s", pipeline_file)
+        return
+    yq_cmd = ["yq", "e", " | ".join(exprs), pipeline_file]
     if dry_run:
-        exprs = "\n".join([f"yq e '{expr}' {pipeline_file}" for expr in exprs])
-        logger.info("dry run:\n%s", exprs)
+        logger.info("dry run: %s", shlex.join(yq_cmd))
         return
-    for expr in exprs:
-        yq_cmd = f"yq e '{expr}' {pipeline_file}"
-        if dry_run:
-            logger.info("dry run: %s", yq_cmd)
-        else:
-            subprocess.run(yq_cmd, shell=True, check=True)
+    proc = subprocess.run(yq_cmd, stdout=subprocess.PIPE, check=True)
+    with open(pipeline_file + ".modified", "wb") as f:
+        f.write(proc.stdout)
 
 
 def analyze_pipeline_run(filename: str):
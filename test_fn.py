@@ -1,6 +1,10 @@
+import io
+
 import fn
 import pytest
 
+from ruamel.yaml import YAML
+
 
 @pytest.mark.parametrize(
     "paths,obj,default_,expected",
@@ -43,3 +47,83 @@ def test_with_path(paths, obj, default_, expected) -> None:
 def test_update(val, condition, obj, expected) -> None:
     r = fn.update(val, condition=condition)(obj)
     assert r == expected
+
+
+def _round_trip_yaml() -> YAML:
+    yaml = YAML()
+    yaml.preserve_quotes = True
+    return yaml
+
+
+def test_delete_if() -> None:
+    obj = [{"name": "a"}, {"name": "b"}, {"name": "a"}, {"name": "c"}]
+    r = fn.delete_if(lambda o: o["name"] == "a")(obj)
+    assert r is obj
+    assert r == [{"name": "b"}, {"name": "c"}]
+
+
+def test_delete_if_keeps_comments() -> None:
+    yaml = _round_trip_yaml()
+    obj = yaml.load("args:\n- a  # ca\n- b  # cb\n- c  # cc\n")
+
+    r = fn.delete_if(lambda o: o == "b")(obj["args"])
+    assert r is obj["args"]
+
+    out = io.StringIO()
+    yaml.dump(obj, out)
+    assert out.getvalue() == "args:\n- a  # ca\n- c  # cc\n"
+
+
+def test_for_each() -> None:
+    obj = [1, 2, 3]
+    r = fn.for_each(lambda o: o + 1, lambda o: o * 10)(obj)
+    assert r is obj
+    assert r == [20, 30, 40]
+
+    yaml = _round_trip_yaml()
+    obj = yaml.load('args:\n- "a"  # ca\n- "b"  # cb\n')
+
+    r = fn.for_each(str.upper)(obj["args"])
+    assert r is obj["args"]
+
+    out = io.StringIO()
+    yaml.dump(obj, out)
+    assert out.getvalue() == 'args:\n- "A"  # ca\n- "B"  # cb\n'
+
+
+def test_append() -> None:
+    to_add = {"name": "netrc", "optional": True}
+
+    r = fn.append(to_add)([])
+    assert r == [to_add]
+    assert r[0] is not to_add
+
+    r = fn.append(to_add, clone=False)([])
+    assert r[0] is to_add
+
+
+def _task_with_ref(**params):
+    return {
+        "name": "init",
+        "taskRef": {
+            "resolver": "bundles",
+            "params": [{"name": k, "value": v} for k, v in params.items()],
+        },
+    }
+
+
+@pytest.mark.parametrize(
+    "task,expected",
+    [
+        [_task_with_ref(name="init", bundle="quay.io/myorg/init:0.1", kind="task"), True],
+        [_task_with_ref(kind="task", bundle="quay.io/myorg/init:0.1", name="init"), True],
+        [_task_with_ref(name="init", bundle="quay.io/myorg/init:0.1"), False],
+        [_task_with_ref(name="init", bundle="quay.io/myorg/init:0.1", kind="pipeline"), False],
+        [_task_with_ref(name="clone", bundle="quay.io/myorg/init:0.1", kind="task"), False],
+        [_task_with_ref(name="init", bundle="quay.io/other/init:0.1", kind="task"), False],
+        [{"name": "init"}, False],
+    ],
+)
+def test_task_ref_matches(task, expected) -> None:
+    r = fn.task_ref_matches("init", r"quay\.io/myorg/")(task)
+    assert r is expected
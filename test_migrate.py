@@ -1,7 +1,13 @@
 
+import io
 import os
+import shlex
+import shutil
+import subprocess
 import sys
 
+import pytest
+
 import fn
 import migrate
 from migrate import main, generate_dsl
@@ -148,5 +154,154 @@ def test_migrate_with_dsl(tmpdir, monkeypatch):
     assert task_init == base_task_init
 
 
-# def test_generate_dsl():
-#     generate_dsl()
+def test_locate_path():
+    pl = migrate.create_yaml_obj().load(to_pipeline)
+
+    params = migrate.locate_path("spec.tasks.init.params")(pl)
+    assert params == pl["spec"]["tasks"][1]["params"]
+
+    with pytest.raises(IndexError):
+        migrate.locate_path("spec.tasks.build.params")(pl)
+
+
+def is_mikefarah_yq() -> bool:
+    if shutil.which("yq") is None:
+        return False
+    proc = subprocess.run(["yq", "--version"], capture_output=True, text=True)
+    return "mikefarah" in proc.stdout
+
+
+@pytest.mark.skipif(not is_mikefarah_yq(), reason="yq (mikefarah/yq) is not installed")
+def test_migrate_with_yq(tmpdir):
+    pipeline_file = write_sample_pipeline_run(tmpdir)
+    exprs = [
+        '(.spec | .pipelineSpec | .tasks[] | select(.name == "step-0")) += {"script": "echo hello"}',
+        "del(.metadata | .labels)",
+    ]
+
+    migrate.migrate_with_yq(exprs, pipeline_file)
+
+    with open(pipeline_file + ".modified", "r", encoding="utf-8") as f:
+        modified_plr = migrate.create_yaml_obj().load(f)
+    assert modified_plr["spec"]["pipelineSpec"]["tasks"] == [
+        {"name": "step-0", "script": "echo hello"},
+    ]
+    assert "labels" not in modified_plr["metadata"]
+
+
+def test_migrate_with_yq_failure(tmpdir, monkeypatch):
+    pipeline_file = write_sample_pipeline_run(tmpdir)
+    bin_dir = tmpdir.mkdir("bin")
+    failing_yq = bin_dir.join("yq")
+    failing_yq.write("#!/bin/sh\necho partial output\nexit 1\n")
+    failing_yq.chmod(0o755)
+    monkeypatch.setenv("PATH", str(bin_dir), prepend=os.pathsep)
+
+    with pytest.raises(subprocess.CalledProcessError):
+        migrate.migrate_with_yq(["del(.metadata | .labels)"], pipeline_file)
+
+    assert not os.path.exists(pipeline_file + ".modified")
+
+
+def test_migrate_with_yq_dry_run(tmpdir, caplog):
+    pipeline_file = write_sample_pipeline_run(tmpdir)
+    exprs = [
+        '(.spec | .tasks[] | select(.name == "step-0")) += {"script": "echo hello"}',
+        'del(.spec | .tasks[] | select(.name == "step-0") | .timeout)',
+    ]
+
+    with caplog.at_level("INFO", logger="migration"):
+        migrate.migrate_with_yq(exprs, pipeline_file, dry_run=True)
+
+    expected_cmd = ["yq", "e", " | ".join(exprs), pipeline_file]
+    assert caplog.messages == [f"dry run: {shlex.join(expected_cmd)}"]
+    assert not os.path.exists(pipeline_file + ".modified")
+
+    caplog.clear()
+    with caplog.at_level("INFO", logger="migration"):
+        migrate.migrate_with_yq([], pipeline_file, dry_run=True)
+
+    assert caplog.messages == [f"no yq expressions to apply to {pipeline_file}"]
+
+
+def test_resolve_pipeline(tmpdir):
+    pipeline_run_file = write_sample_pipeline_run(tmpdir)
+    with open(pipeline_run_file, "r", encoding="utf-8") as f:
+        plr = migrate.create_yaml_obj().load(f)
+
+    pipeline = migrate.resolve_pipeline(plr, pipeline_run_file)
+    assert pipeline["spec"] is plr["spec"]["pipelineSpec"]
+
+    pl = migrate.create_yaml_obj().load(from_pipeline)
+    assert migrate.resolve_pipeline(pl, pipeline_run_file) is pl
+
+    del plr["spec"]["pipelineSpec"]
+    with pytest.raises(ValueError):
+        migrate.resolve_pipeline(plr, pipeline_run_file)
+
+
+def test_generate_dsl_migrations_are_reusable():
+    differences = {
+        "spec.tasks.init.params": {
+            "+ one list entry added:": "- name: cache\n  value: \"true\"\n",
+        },
+    }
+    migrations = generate_dsl(differences)
+    yaml = migrate.create_yaml_obj()
+    pl_1 = yaml.load(to_pipeline)
+    pl_2 = yaml.load(to_pipeline)
+
+    for pl in (pl_1, pl_2):
+        for migration in migrations:
+            migration(pl)
+
+    locate_params = migrate.locate_path("spec.tasks.init.params")
+    locate_params(pl_1)[-1]["value"] = "false"
+    assert locate_params(pl_2)[-1] == {"name": "cache", "value": "true"}
+
+
+def test_generate_dsl():
+    differences = {
+        "spec.tasks.init.params": {
+            "+ one list entry added:": "- name: cache\n  value: \"true\"\n",
+            "- two list entries removed:": (
+                "- name: rebuild\n  value: $(params.rebuild)\n"
+                "- name: skip-checks\n  value: $(params.skip-checks)\n"
+            ),
+        },
+    }
+    yaml = migrate.create_yaml_obj()
+    pl = yaml.load("""\
+spec:
+  tasks:
+  - name: init
+    params:
+    - name: image-url  # the built image
+      value: "$(params.output-image)"
+    - name: rebuild
+      value: $(params.rebuild)
+    - name: dockerfile  # relative to the context
+      value: 'Dockerfile'
+    - name: skip-checks
+      value: $(params.skip-checks)
+    - {name: context, value: "."}  # kept by the list itself
+""")
+
+    for migration in generate_dsl(differences):
+        migration(pl)
+
+    out = io.StringIO()
+    yaml.dump(pl, out)
+    assert out.getvalue() == """\
+spec:
+  tasks:
+  - name: init
+    params:
+    - name: image-url  # the built image
+      value: "$(params.output-image)"
+    - name: dockerfile  # relative to the context
+      value: 'Dockerfile'
+    - {name: context, value: "."}  # kept by the list itself
+    - name: cache
+      value: "true"
+"""